@@ -25,5 +25,7 @@ class ThreadLocal(threading.local):
         threading.local.__init__(self)
         self.__dict__.update(kwargs)
 
-def get_thread_id():
-    return threading._get_ident()
+try:
+    get_thread_id = threading.get_ident
+except AttributeError:
+    get_thread_id = threading._get_ident
@@ -18,9 +18,12 @@
 #         Matthew Good <trac@matt-good.net>
 
 import math
+import os
 import re
+import struct
 import sys
 import time
+from bisect import bisect_right
 from datetime import tzinfo, timedelta, datetime, date
 from locale import getlocale, LC_TIME
 
@@ -40,7 +43,7 @@ except ImportError:
     babel = None
 
 from trac.core import TracError
-from trac.util.text import to_unicode, getpreferredencoding
+from trac.util.text import getpreferredencoding
 from trac.util.translation import _, ngettext, get_available_locales
 
 # Date/time utilities
@@ -738,6 +741,69 @@ class FixedOffset(tzinfo):
         return dt
 
 
+def _read_tzfile(path):
+    """Read the transitions of a TZif compiled time zone file.
+
+    Return a `(transitions, types)` tuple where `transitions` is the sorted
+    list of transition timestamps and `types` the list of the corresponding
+    `(utcoffset, is_dst)` tuples, or `None` if the file can't be used.
+    """
+    try:
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+    header = struct.Struct('>4sc15x6l')
+    if len(data) < header.size or data[:4] != 'TZif':
+        return None
+    try:
+        magic, version, isutcnt, isstdcnt, leapcnt, timecnt, typecnt, \
+            charcnt = header.unpack_from(data)
+        timefmt = 'l'
+        if version >= '2':
+            # skip the 32-bit data block, use the 64-bit one
+            offset = header.size + timecnt * 5 + typecnt * 6 + charcnt + \
+                     leapcnt * 8 + isstdcnt + isutcnt
+            magic, version, isutcnt, isstdcnt, leapcnt, timecnt, typecnt, \
+                charcnt = header.unpack_from(data, offset)
+            timefmt = 'q'
+        else:
+            offset = 0
+        if leapcnt or not timecnt:
+            return None
+        offset += header.size
+        transitions = list(struct.unpack_from('>%d%s' % (timecnt, timefmt),
+                                              data, offset))
+        offset += struct.calcsize(timefmt) * timecnt
+        indices = struct.unpack_from('>%dB' % timecnt, data, offset)
+        offset += timecnt
+        ttinfos = [struct.unpack_from('>lBx', data, offset + idx * 6)
+                   for idx in xrange(typecnt)]
+        types = [(timedelta(seconds=ttinfos[idx][0]), ttinfos[idx][1] != 0)
+                 for idx in indices]
+    except (struct.error, IndexError):
+        return None
+    return transitions, types
+
+
+def _get_localtime_tzfile():
+    """Return the TZif file used by the C library for local time, if any."""
+    tzname = os.environ.get('TZ')
+    if tzname is None:
+        return '/etc/localtime'
+    if tzname.startswith(':'):
+        tzname = tzname[1:]
+    if not tzname:
+        return None
+    if os.path.isabs(tzname):
+        return tzname
+    return os.path.join(os.environ.get('TZDIR') or '/usr/share/zoneinfo',
+                        tzname)
+
+
 class LocalTimezone(tzinfo):
     """A 'local' time zone implementation"""
 
@@ -746,6 +812,8 @@ class LocalTimezone(tzinfo):
     _dst_diff = None
     _std_tz = None
     _dst_tz = None
+    _transitions = None
+    _types = None
 
     @classmethod
     def _initialize(cls):
@@ -758,6 +826,30 @@ class LocalTimezone(tzinfo):
             cls._dst_tz = cls._std_tz
             cls._dst_offset = cls._std_offset
         cls._dst_diff = cls._dst_offset - cls._std_offset
+        cls._transitions = cls._types = None
+        path = _get_localtime_tzfile()
+        tzdata = _read_tzfile(path) if path else None
+        if tzdata and cls._check_tzdata(*tzdata):
+            cls._transitions, cls._types = tzdata
+        # pin the zones and transitions as fast locals of `fromutc`
+        fromutc = cls.fromutc.im_func
+        fromutc.func_defaults = (cls._std_tz, cls._dst_tz, cls._transitions,
+                                 cls._types) + fromutc.func_defaults[4:]
+
+    @staticmethod
+    def _check_tzdata(transitions, types):
+        """Verify that the transitions read from the TZif file agree with
+        `time.localtime()`, in case the C library uses something else."""
+        ts = int(time.time())
+        if not transitions[0] <= ts < transitions[-1]:
+            ts = transitions[-1] - 1
+        try:
+            tt = time.localtime(ts)
+        except (ValueError, OverflowError):
+            return False
+        offset, is_dst = types[bisect_right(transitions, ts) - 1]
+        dt = datetime(1970, 1, 1) + timedelta(seconds=ts) + offset
+        return dt.timetuple()[0:6] == tt[0:6] and is_dst == (tt.tm_isdst > 0)
 
     def __init__(self, is_dst=None):
         self.is_dst = is_dst
@@ -836,15 +928,23 @@ class LocalTimezone(tzinfo):
             return dt
         return self.fromutc(dt.replace(tzinfo=self) - dt.utcoffset())
 
-    def fromutc(self, dt):
+    def fromutc(self, dt, _std_tz=None, _dst_tz=None, _transitions=None,
+                _types=None, _localtime=time.localtime, _datetime=datetime):
         if dt.tzinfo is None or dt.tzinfo is not self:
             raise ValueError('fromutc: dt.tzinfo is not self')
-        tt = time.localtime(to_timestamp(dt.replace(tzinfo=utc)))
+        ts = to_timestamp(dt.replace(tzinfo=utc))
+        if _transitions and _transitions[0] <= ts < _transitions[-1]:
+            # look up the local time type in the TZif transitions rather
+            # than calling the C library
+            offset, is_dst = _types[bisect_right(_transitions, ts) - 1]
+            return (dt + offset).replace(tzinfo=_dst_tz if is_dst
+                                                else _std_tz)
+        tt = _localtime(ts)
         if tt.tm_isdst > 0:
-            tz = self._dst_tz
+            tz = _dst_tz
         else:
-            tz = self._std_tz
-        return datetime(microsecond=dt.microsecond, tzinfo=tz, *tt[0:6])
+            tz = _std_tz
+        return _datetime(microsecond=dt.microsecond, tzinfo=tz, *tt[0:6])
 
 
 utc = FixedOffset(0, 'UTC')
@@ -890,6 +990,12 @@ try:
 
     _tzoffsetmap = dict([(tz.utcoffset(None), tz) for tz in _timezones
                          if tz.zone != 'UTC'])
+    # pytz 'Etc/*' zones are mapped to the equivalent 'GMT' fixed offset
+    # zones (or `None` for offsets without one)
+    _etc_to_fixed = dict([(tzname, _tzoffsetmap.get(
+                               pytz.timezone(tzname).utcoffset(None)))
+                          for tzname in pytz.all_timezones
+                          if tzname.startswith('Etc/')])
 
     def timezone(tzname):
         """Fetch timezone instance by name or raise `KeyError`"""
@@ -900,15 +1006,17 @@ try:
 
     def get_timezone(tzname):
         """Fetch timezone instance by name or return `None`"""
-        try:
+        name = tzname
+        if not isinstance(name, str):
             # if given unicode parameter, pytz.timezone fails with:
             # "type() argument 1 must be string, not unicode"
-            tz = pytz.timezone(to_unicode(tzname).encode('ascii', 'replace'))
-        except (KeyError, IOError):
+            from trac.util.text import to_unicode
+            name = to_unicode(name).encode('ascii', 'replace')
+        try:
+            tz = pytz.timezone(name)
+        except (KeyError, IOError, UnicodeError):
             tz = _tzmap.get(tzname)
-        if tz and tzname.startswith('Etc/'):
-            tz = _tzoffsetmap.get(tz.utcoffset(None))
-        return tz
+        return _etc_to_fixed.get(tzname, tz)
 
     _pytz_zones = [tzname for tzname in pytz.common_timezones
                    if not tzname.startswith('Etc/') and
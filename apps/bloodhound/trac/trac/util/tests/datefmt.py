@@ -1133,6 +1133,18 @@ class LocalTimezoneTestCase(unittest.TestCase):
         self.assertEqual('2011-07-16T01:57:42.123456+02:00',
                          dt.astimezone(datefmt.localtz).isoformat())
 
+    def test_astimezone_tzfile_transitions(self):
+        self._tzset('Europe/Paris')
+        if not datefmt.LocalTimezone._transitions:
+            return # no compiled time zone data available
+        for ts in xrange(0, 2 ** 31 - 1, 86400 * 7 + 3601):
+            dt = datetime.datetime.fromtimestamp(ts, datefmt.utc)
+            tt = time.localtime(ts)
+            localized = dt.astimezone(datefmt.localtz)
+            self.assertEqual(tt[0:6], localized.timetuple()[0:6])
+            self.assertEqual(tt.tm_isdst > 0,
+                             localized.tzinfo is datefmt.LocalTimezone._dst_tz)
+
     def test_astimezone_non_utc(self):
         self._tzset('Europe/Paris')
         dt = datetime.datetime(2012, 1, 23, 16, 32, 42, 123456,
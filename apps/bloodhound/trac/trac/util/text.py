@@ -24,6 +24,7 @@ import os
 import re
 import sys
 import textwrap
+from itertools import islice, izip
 from urllib import quote, quote_plus, unquote
 from unicodedata import east_asian_width
 
@@ -690,6 +691,19 @@ def unicode_from_base64(text):
 
 def levenshtein_distance(lhs, rhs):
     """Return the Levenshtein distance between two strings."""
+    # common prefix and suffix don't contribute to the distance
+    minlen = min(len(lhs), len(rhs))
+    prefix = 0
+    while prefix < minlen and lhs[prefix] == rhs[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < minlen - prefix and \
+            lhs[-1 - suffix] == rhs[-1 - suffix]:
+        suffix += 1
+    if prefix or suffix:
+        lhs = lhs[prefix:len(lhs) - suffix]
+        rhs = rhs[prefix:len(rhs) - suffix]
+
     if len(lhs) > len(rhs):
         rhs, lhs = lhs, rhs
     if not lhs:
@@ -698,10 +712,12 @@ def levenshtein_distance(lhs, rhs):
     prev = range(len(rhs) + 1)
     for lidx, lch in enumerate(lhs):
         curr = [lidx + 1]
-        for ridx, rch in enumerate(rhs):
-            cost = (lch != rch) * 2
-            curr.append(min(prev[ridx + 1] + 1, # deletion
-                            curr[ridx] + 1,     # insertion
-                            prev[ridx] + cost)) # substitution
+        append = curr.append
+        left = lidx + 1
+        for diag, up, rch in izip(prev, islice(prev, 1, None), rhs):
+            left = min(up + 1,                  # deletion
+                       left + 1,                # insertion
+                       diag + (lch != rch) * 2) # substitution
+            append(left)
         prev = curr
     return prev[-1]
@@ -128,6 +128,7 @@ try:
             self._plugin_domains = {}
             self._plugin_domains_lock = threading.RLock()
             self._activate_failed = False
+            self._loaded_translations = {}
 
         # Public API
 
@@ -145,18 +146,25 @@ try:
             except Exception:
                 self._activate_failed = True
                 return
-            t = Translations.load(locale_dir, locale or 'en_US')
-            if not t or t.__class__ is NullTranslations:
-                t = self._null_translations
-            else:
-                t.add(Translations.load(locale_dir, locale or 'en_US',
-                                        'tracini'))
-                if env_path:
-                    with self._plugin_domains_lock:
-                        domains = self._plugin_domains.get(env_path, {})
-                        domains = domains.items()
+            domains = ()
+            if env_path:
+                with self._plugin_domains_lock:
+                    domains = self._plugin_domains.get(env_path, {})
+                    domains = tuple(domains.items())
+            # The catalogs are only loaded once for a given locale and set
+            # of domains, and then shared by all threads
+            key = (locale and str(locale), env_path, domains)
+            t = self._loaded_translations.get(key)
+            if t is None:
+                t = Translations.load(locale_dir, locale or 'en_US')
+                if not t or t.__class__ is NullTranslations:
+                    t = self._null_translations
+                else:
+                    t.add(Translations.load(locale_dir, locale or 'en_US',
+                                            'tracini'))
                     for domain, dirname in domains:
                         t.add(Translations.load(dirname, locale, domain))
+                self._loaded_translations[key] = t
             self._current.translations = t
             self._activate_failed = False
 
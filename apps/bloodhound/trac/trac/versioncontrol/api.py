@@ -18,12 +18,14 @@ from __future__ import with_statement
 
 import os.path
 import time
+from itertools import groupby
+from operator import itemgetter
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
 from trac.config import ConfigSection, ListOption, Option
 from trac.core import *
 from trac.resource import IResourceManager, Resource, ResourceNotFound
-from trac.util.concurrency import threading
+from trac.util.concurrency import get_thread_id, threading
 from trac.util.text import printout, to_unicode
 from trac.util.translation import _
 from trac.web.api import IRequestFilter
@@ -118,14 +120,15 @@ class DbRepositoryProvider(Component):
 
     def get_repositories(self):
         """Retrieve repositories specified in the repository DB table."""
-        repos = {}
-        for id, name, value in self.env.db_query(
-                "SELECT id, name, value FROM repository WHERE name IN (%s)"
-                % ",".join("'%s'" % each for each in self.repository_attrs)):
-            if value is not None:
-                repos.setdefault(id, {})[name] = value
+        rows = self.env.db_query("""
+                SELECT id, name, value FROM repository WHERE name IN (%s)
+                ORDER BY id
+                """ % ','.join(['%s'] * len(self.repository_attrs)),
+                self.repository_attrs)
         reponames = {}
-        for id, info in repos.iteritems():
+        for id, attrs in groupby(rows, key=itemgetter(0)):
+            info = dict((name, value) for id_, name, value in attrs
+                        if value is not None)
             if 'name' in info and ('dir' in info or 'alias' in info):
                 info['id'] = id
                 reponames[info['name']] = info
@@ -251,24 +254,28 @@ class DbRepositoryProvider(Component):
         if is_default(reponame):
             reponame = ''
         rm = RepositoryManager(self.env)
+        repository_attrs = self.repository_attrs
+        values = {}
+        for k, v in changes.iteritems():
+            if k not in repository_attrs:
+                continue
+            if k in ('alias', 'name') and is_default(v):
+                v = ''
+            if k == 'dir' and not os.path.isabs(v):
+                raise TracError(_("The repository directory must be "
+                                  "absolute"))
+            values[k] = v
         with self.env.db_transaction as db:
             id = rm.get_repository_id(reponame)
-            for (k, v) in changes.iteritems():
-                if k not in self.repository_attrs:
-                    continue
-                if k in ('alias', 'name') and is_default(v):
-                    v = ''
-                if k == 'dir' and not os.path.isabs(v):
-                    raise TracError(_("The repository directory must be "
-                                      "absolute"))
-                db("UPDATE repository SET value=%s WHERE id=%s AND name=%s",
-                   (v, id, k))
-                if not db(
-                        "SELECT value FROM repository WHERE id=%s AND name=%s",
-                        (id, k)):
-                    db("""INSERT INTO repository (id, name, value)
-                          VALUES (%s, %s, %s)
-                          """, (id, k, v))
+            existing = set(name for name, in db(
+                "SELECT name FROM repository WHERE id=%s", (id,)))
+            db.executemany(
+                "UPDATE repository SET value=%s WHERE id=%s AND name=%s",
+                [(v, id, k) for k, v in values.iteritems() if k in existing])
+            db.executemany(
+                "INSERT INTO repository (id, name, value) VALUES (%s, %s, %s)",
+                [(id, k, v) for k, v in values.iteritems()
+                 if k not in existing])
         rm.reload_repositories()
 
 
@@ -329,33 +336,38 @@ class RepositoryManager(Component):
         self._lock = threading.Lock()
         self._connectors = None
         self._all_repositories = None
+        self._repository_trie = None
+        self._repository_dirs = None
+        self._reponames_by_base = None
+        self._repository_ids = None
+        self._reponames_to_sync = None
 
     # IRequestFilter methods
 
     def pre_process_request(self, req, handler):
+        reponames = self._get_reponames_to_sync()
+        if not reponames:
+            return handler
         from trac.web.chrome import Chrome, add_warning
         if handler is not Chrome(self.env):
-            for reponame in self.repository_sync_per_request:
+            for reponame, displayname in reponames:
                 start = time.time()
-                if is_default(reponame):
-                    reponame = ''
                 try:
                     repo = self.get_repository(reponame)
                     if repo:
                         repo.sync()
                     else:
                         self.log.warning("Unable to find repository '%s' for "
-                                         "synchronization",
-                                         reponame or '(default)')
+                                         "synchronization", displayname)
                         continue
                 except TracError, e:
                     add_warning(req,
                         _("Can't synchronize with repository \"%(name)s\" "
                           "(%(error)s). Look in the Trac log for more "
-                          "information.", name=reponame or '(default)',
+                          "information.", name=displayname,
                           error=to_unicode(e.message)))
                 self.log.info("Synchronized '%s' repository in %0.2f seconds",
-                              reponame or '(default)', time.time() - start)
+                              displayname, time.time() - start)
         return handler
 
     def post_process_request(self, req, template, data, content_type):
@@ -369,49 +381,69 @@ class RepositoryManager(Component):
         yield 'repository'
 
     def get_resource_description(self, resource, format=None, **kwargs):
-        if resource.realm == 'changeset':
-            parent = resource.parent
-            reponame = parent and parent.id
-            id = resource.id
-            if reponame:
-                return _("Changeset %(rev)s in %(repo)s", rev=id, repo=reponame)
-            else:
-                return _("Changeset %(rev)s", rev=id)
-        elif resource.realm == 'source':
-            parent = resource.parent
-            reponame = parent and parent.id
-            id = resource.id
-            version = ''
-            if format == 'summary':
-                repos = self.get_repository(reponame)
-                node = repos.get_node(resource.id, resource.version)
-                if node.isdir:
-                    kind = _("directory")
-                elif node.isfile:
-                    kind = _("file")
-                if resource.version:
-                    version = _(" at version %(rev)s", rev=resource.version)
-            else:
-                kind = _("path")
-                if resource.version:
-                    version = '@%s' % resource.version
-            in_repo = _(" in %(repo)s", repo=reponame) if reponame else ''
-            # TRANSLATOR: file /path/to/file.py at version 13 in reponame
-            return _('%(kind)s %(id)s%(at_version)s%(in_repo)s',
-                     kind=kind, id=id, at_version=version, in_repo=in_repo)
-        elif resource.realm == 'repository':
-            return _("Repository %(repo)s", repo=resource.id)
+        describe = self._resource_descriptions.get(resource.realm)
+        if describe:
+            return describe(self, resource, format)
 
     def get_resource_url(self, resource, href, **kwargs):
-        if resource.realm == 'changeset':
-            parent = resource.parent
-            return href.changeset(resource.id, parent and parent.id or None)
-        elif resource.realm == 'source':
-            parent = resource.parent
-            return href.browser(parent and parent.id or None, resource.id,
-                                rev=resource.version or None)
-        elif resource.realm == 'repository':
-            return href.browser(resource.id or None)
+        get_url = self._resource_urls.get(resource.realm)
+        if get_url:
+            return get_url(self, resource, href)
+
+    def _describe_changeset(self, resource, format):
+        parent = resource.parent
+        reponame = parent and parent.id
+        id = resource.id
+        if reponame:
+            return _("Changeset %(rev)s in %(repo)s", rev=id, repo=reponame)
+        else:
+            return _("Changeset %(rev)s", rev=id)
+
+    def _describe_source(self, resource, format):
+        parent = resource.parent
+        reponame = parent and parent.id
+        id = resource.id
+        version = ''
+        if format == 'summary':
+            repos = self.get_repository(reponame)
+            node = repos.get_node(resource.id, resource.version)
+            if node.isdir:
+                kind = _("directory")
+            elif node.isfile:
+                kind = _("file")
+            if resource.version:
+                version = _(" at version %(rev)s", rev=resource.version)
+        else:
+            kind = _("path")
+            if resource.version:
+                version = '@%s' % resource.version
+        in_repo = _(" in %(repo)s", repo=reponame) if reponame else ''
+        # TRANSLATOR: file /path/to/file.py at version 13 in reponame
+        return _('%(kind)s %(id)s%(at_version)s%(in_repo)s',
+                 kind=kind, id=id, at_version=version, in_repo=in_repo)
+
+    def _describe_repository(self, resource, format):
+        return _("Repository %(repo)s", repo=resource.id)
+
+    _resource_descriptions = {'changeset': _describe_changeset,
+                              'source': _describe_source,
+                              'repository': _describe_repository}
+
+    def _get_changeset_url(self, resource, href):
+        parent = resource.parent
+        return href.changeset(resource.id, parent and parent.id or None)
+
+    def _get_source_url(self, resource, href):
+        parent = resource.parent
+        return href.browser(parent and parent.id or None, resource.id,
+                            rev=resource.version or None)
+
+    def _get_repository_url(self, resource, href):
+        return href.browser(resource.id or None)
+
+    _resource_urls = {'changeset': _get_changeset_url,
+                      'source': _get_source_url,
+                      'repository': _get_repository_url}
 
     def resource_exists(self, resource):
         if resource.realm == 'repository':
@@ -449,23 +481,30 @@ class RepositoryManager(Component):
         # eventually add pre-0.12 default repository
         if self.repository_dir:
             reponames[''] = {'dir': self.repository_dir}
-        # first pass to gather the <name>.dir entries
+        # single pass to gather the <name>.dir entries, and to sort out
+        # the aliases and the other <name>.<detail> entries
+        aliases = []
+        details = []
         for option in repositories:
-            if option.endswith('.dir'):
-                reponames[option[:-4]] = {}
-        # second pass to gather aliases
-        for option in repositories:
-            alias = repositories.get(option)
+            value = repositories.get(option)
             if '.' not in option:   # Support <alias> = <repo> syntax
-                option += '.alias'
-            if option.endswith('.alias') and alias in reponames:
-                reponames.setdefault(option[:-6], {})['alias'] = alias
-        # third pass to gather the <name>.<detail> entries
-        for option in repositories:
-            if '.' in option:
-                name, detail = option.rsplit('.', 1)
-                if name in reponames and detail != 'alias':
-                    reponames[name][detail] = repositories.get(option)
+                aliases.append((option, value))
+                continue
+            name, detail = option.rsplit('.', 1)
+            if detail == 'alias':
+                aliases.append((name, value))
+                continue
+            if detail == 'dir':
+                reponames[name] = {}
+            details.append((name, detail, value))
+        # then apply the aliases to the known repositories
+        for name, alias in aliases:
+            if alias in reponames:
+                reponames.setdefault(name, {})['alias'] = alias
+        # and finally the <name>.<detail> entries
+        for name, detail, value in details:
+            if name in reponames:
+                reponames[name][detail] = value
 
         for reponame, info in reponames.iteritems():
             yield (reponame, info)
@@ -474,10 +513,8 @@ class RepositoryManager(Component):
 
     def get_supported_types(self):
         """Return the list of supported repository types."""
-        types = set(type_ for connector in self.connectors
-                    for (type_, prio) in connector.get_supported_types() or []
-                    if prio >= 0)
-        return list(types)
+        return [type_ for type_, (connector, prio)
+                in self._get_connectors().iteritems() if prio >= 0]
 
     def get_repositories_by_dir(self, directory):
         """Retrieve the repositories based on the given directory.
@@ -487,14 +524,12 @@ class RepositoryManager(Component):
         """
         directory = os.path.join(os.path.normcase(directory), '')
         repositories = []
-        for reponame, repoinfo in self.get_all_repositories().iteritems():
-            dir = repoinfo.get('dir')
-            if dir:
-                dir = os.path.join(os.path.normcase(dir), '')
-                if dir.startswith(directory):
-                    repos = self.get_repository(reponame)
-                    if repos:
-                        repositories.append(repos)
+        self.get_all_repositories()
+        for reponame, dir in (self._repository_dirs or {}).iteritems():
+            if dir.startswith(directory):
+                repos = self.get_repository(reponame)
+                if repos:
+                    repositories.append(repos)
         return repositories
 
     def get_repository_id(self, reponame):
@@ -505,6 +540,9 @@ class RepositoryManager(Component):
         \note: this should probably be renamed as we're dealing
                exclusively with *db* repository ids here.
         """
+        id = self._get_repository_ids().get(reponame)
+        if id is not None:
+            return id
         with self.env.db_transaction as db:
             for id, in db(
                     "SELECT id FROM repository WHERE name='name' AND value=%s",
@@ -527,27 +565,33 @@ class RepositoryManager(Component):
                     simply return `None`.
         """
         reponame = reponame or ''
-        repoinfo = self.get_all_repositories().get(reponame, {})
+        all_repositories = self.get_all_repositories()
+        repoinfo = all_repositories.get(reponame, {})
         if 'alias' in repoinfo:
             reponame = repoinfo['alias']
-            repoinfo = self.get_all_repositories().get(reponame, {})
+            repoinfo = all_repositories.get(reponame, {})
         rdir = repoinfo.get('dir')
         if not rdir:
             return None
-        rtype = repoinfo.get('type') or self.repository_type
 
         # get a Repository for the reponame (use a thread-level cache)
+        repositories = self._cache.get(get_thread_id())
+        if repositories:
+            repos = repositories.get(reponame)
+            if repos:
+                return repos
         with self.env.db_transaction: # prevent possible deadlock, see #4465
             with self._lock:
-                tid = threading._get_ident()
-                if tid in self._cache:
-                    repositories = self._cache[tid]
-                else:
-                    repositories = self._cache[tid] = {}
+                cache = self._cache
+                tid = get_thread_id()
+                repositories = cache.get(tid)
+                if repositories is None:
+                    repositories = cache[tid] = {}
                 repos = repositories.get(reponame)
                 if not repos:
                     if not os.path.isabs(rdir):
                         rdir = os.path.join(self.env.path, rdir)
+                    rtype = repoinfo.get('type') or self.repository_type
                     connector = self._get_connector(rtype)
                     repos = connector.get_repository(rtype, rdir,
                                                      repoinfo.copy())
@@ -562,18 +606,20 @@ class RepositoryManager(Component):
                  the remaining part of `path` once the `reponame` has
                  been truncated, if needed.
         """
-        matches = []
         path = path.strip('/') + '/' if path else '/'
-        for reponame in self.get_all_repositories().keys():
-            stripped_reponame = reponame.strip('/') + '/'
-            if path.startswith(stripped_reponame):
-                matches.append((len(stripped_reponame), reponame))
-        if matches:
-            matches.sort()
-            length, reponame = matches[-1]
-            path = path[length:]
-        else:
-            reponame = ''
+        self.get_all_repositories()
+        node = self._repository_trie or {}
+        reponame = ''
+        length = end = 0
+        for segment in path[:-1].split('/'):
+            node = node.get(segment)
+            if node is None:
+                break
+            end += len(segment) + 1
+            if None in node:
+                reponame = node[None]
+                length = end
+        path = path[length:]
         return (reponame, self.get_repository(reponame),
                 path.rstrip('/') or '/')
 
@@ -592,6 +638,7 @@ class RepositoryManager(Component):
         """Return a dictionary of repository information, indexed by name."""
         if not self._all_repositories:
             all_repositories = {}
+            repository_dirs = {}
             for provider in self.providers:
                 for reponame, info in provider.get_repositories() or []:
                     if reponame in all_repositories:
@@ -602,13 +649,29 @@ class RepositoryManager(Component):
                         if 'id' not in info:
                             info['id'] = self.get_repository_id(reponame)
                         all_repositories[reponame] = info
+                        dir = info.get('dir')
+                        if dir:
+                            repository_dirs[reponame] = \
+                                os.path.join(os.path.normcase(dir), '')
+            # trie of the reponame path segments, for
+            # `get_repository_by_path`
+            repository_trie = {}
+            for reponame in all_repositories:
+                node = repository_trie
+                for segment in reponame.strip('/').split('/'):
+                    node = node.setdefault(segment, {})
+                node[None] = max(node.get(None), reponame)
+            self._repository_trie = repository_trie
+            self._repository_dirs = repository_dirs
             self._all_repositories = all_repositories
         return self._all_repositories
 
     def get_real_repositories(self):
         """Return a set of all real repositories (i.e. excluding aliases)."""
         repositories = set()
-        for reponame in self.get_all_repositories():
+        for reponame, info in self.get_all_repositories().iteritems():
+            if 'alias' in info:
+                continue # resolves to one of the real repositories
             try:
                 repos = self.get_repository(reponame)
                 if repos is not None:
@@ -623,6 +686,11 @@ class RepositoryManager(Component):
             # FIXME: trac-admin doesn't reload the environment
             self._cache = {}
             self._all_repositories = None
+            self._repository_trie = None
+            self._repository_dirs = None
+            self._reponames_by_base = None
+            self._repository_ids = None
+            self._reponames_to_sync = None
         self.config.touch()     # Force environment reload
 
     def notify(self, event, reponame, revs):
@@ -648,8 +716,8 @@ class RepositoryManager(Component):
             else:
                 base = reponame
         if base:
-            repositories = [r for r in self.get_real_repositories()
-                            if r.get_base() == base]
+            repositories = [self.get_repository(name) for name
+                            in self._get_reponames_by_base().get(base, ())]
         if not repositories:
             self.log.warn("Found no repositories matching '%s' base.",
                           base or reponame)
@@ -676,7 +744,7 @@ class RepositoryManager(Component):
     def shutdown(self, tid=None):
         """Free `Repository` instances bound to a given thread identifier"""
         if tid:
-            assert tid == threading._get_ident()
+            assert tid == get_thread_id()
             with self._lock:
                 repositories = self._cache.pop(tid, {})
                 for reponame, repos in repositories.iteritems():
@@ -684,24 +752,69 @@ class RepositoryManager(Component):
 
     # private methods
 
+    def _get_reponames_to_sync(self):
+        """Return the `(reponame, displayname)` pairs of the repositories
+        to synchronize on every request."""
+        reponames = self._reponames_to_sync
+        if reponames is None:
+            reponames = []
+            for reponame in self.repository_sync_per_request:
+                if is_default(reponame):
+                    reponame = ''
+                reponames.append((reponame, reponame or '(default)'))
+            self._reponames_to_sync = reponames
+        return reponames
+
+    def _get_repository_ids(self):
+        """Return a dictionary of the repository ids stored in the
+        database, indexed by name."""
+        repository_ids = self._repository_ids
+        if repository_ids is None:
+            repository_ids = {}
+            for id, reponame in self.env.db_query(
+                    "SELECT id, value FROM repository WHERE name='name'"):
+                repository_ids.setdefault(reponame, id)
+            self._repository_ids = repository_ids
+        return repository_ids
+
+    def _get_reponames_by_base(self):
+        """Return a dictionary of real repository names, indexed by the
+        base of the repositories."""
+        reponames_by_base = self._reponames_by_base
+        if reponames_by_base is None:
+            reponames_by_base = {}
+            for repos in self.get_real_repositories():
+                reponames_by_base.setdefault(repos.get_base(), []) \
+                                 .append(repos.reponame)
+            self._reponames_by_base = reponames_by_base
+        return reponames_by_base
+
+    def _get_connectors(self):
+        """Return the preferred `(connector, priority)` pair for each
+        supported repository type.
+
+        The table is built once for the environment and kept across
+        `reload_repositories()`, as the enabled connectors can't change
+        without an environment reload.
+        """
+        connectors = self._connectors
+        if connectors is None:
+            connectors = {}
+            for connector in self.connectors:
+                for type_, prio in connector.get_supported_types() or []:
+                    if type_ not in connectors or prio > connectors[type_][1]:
+                        connectors[type_] = (connector, prio)
+            self._connectors = connectors
+        return connectors
+
     def _get_connector(self, rtype):
         """Retrieve the appropriate connector for the given repository type.
 
         Note that the self._lock must be held when calling this method.
         """
-        if self._connectors is None:
-            # build an environment-level cache for the preferred connectors
-            self._connectors = {}
-            for connector in self.connectors:
-                for type_, prio in connector.get_supported_types() or []:
-                    keep = (connector, prio)
-                    if type_ in self._connectors and \
-                            prio <= self._connectors[type_][1]:
-                        keep = None
-                    if keep:
-                        self._connectors[type_] = keep
-        if rtype in self._connectors:
-            connector, prio = self._connectors[rtype]
+        connectors = self._get_connectors()
+        if rtype in connectors:
+            connector, prio = connectors[rtype]
             if prio >= 0: # no error condition
                 return connector
             else:
@@ -17,25 +17,27 @@
 #         Matthew Good <trac@matt-good.net>
 
 import os.path
+import time
 
 from trac.config import Option, PathOption
 from trac.core import *
 from trac.perm import IPermissionPolicy
 from trac.util import read_file
+from trac.util.concurrency import threading
 from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _
 from trac.versioncontrol.api import RepositoryManager
 
 
 def parent_iter(path):
+    end = len(path)
     while 1:
-        yield path
-        if path == '/':
+        yield path[:end]
+        if end <= 1:
             return
-        path = path[:-1]
-        yield path
-        idx = path.rfind('/')
-        path = path[:idx + 1]
+        end -= 1
+        yield path[:end]
+        end = path.rfind('/', 0, end) + 1
 
 
 def join(*args):
@@ -43,6 +45,31 @@ def join(*args):
     return '/'.join(arg for arg in args if arg)
 
 
+def allowed_users_by_dir(paths):
+    """Return the users granted access below each directory, for the authz
+    `paths` of a module.
+
+    The returned dict maps each parent directory (with a trailing `/`) of
+    the `paths` to the set of users granted access to at least one path
+    below it.
+    """
+    allowed = {}
+    for path, section in paths.iteritems():
+        users = [user for user, result in section.iteritems() if result]
+        if users:
+            idx = path.find('/')
+            while idx != -1:
+                allowed.setdefault(path[:idx + 1], set()).update(users)
+                idx = path.find('/', idx + 1)
+    return allowed
+
+
+# Parsed authz files shared by all environments of the process, indexed by
+# path. Each entry is a `(key, (authz, users, allowed))` tuple, where `key`
+# identifies the file version and the modules that were retained.
+_parsed_authz_files = {}
+
+
 class ParseError(Exception):
     """Exception thrown for parse errors in authz files"""
 
@@ -61,10 +88,11 @@ def parse(authz, modules):
     lineno = 0
     for line in authz.splitlines():
         lineno += 1
-        line = to_unicode(line.strip())
-        if not line or line.startswith(('#', ';')):
+        line = line.strip()
+        if not line or line[0] in '#;':
             continue
-        if line.startswith('[') and line.endswith(']'):
+        line = to_unicode(line)
+        if line[0] == '[' and line[-1] == ']':
             section = line[1:-1]
             continue
         if section is None:
@@ -87,23 +115,42 @@ def parse(authz, modules):
             if module in modules:
                 sections.setdefault((module, path), []).append((name, value))
 
-    def resolve(subject, done):
-        if subject.startswith('@'):
-            done.add(subject)
-            for members in groups[subject[1:]] - done:
-                for each in resolve(members, done):
-                    yield each
-        elif subject.startswith('&'):
-            yield aliases[subject[1:]]
-        else:
-            yield subject
+    expanded = {}
+
+    def expand(group):
+        """Return the users of `group`, including those of nested groups."""
+        users = expanded.get(group)
+        if users is None:
+            users = set()
+            done = set([group])
+            stack = [group]
+            while stack:
+                for member in groups[stack.pop()]:
+                    if member.startswith('@'):
+                        member = member[1:]
+                        if member not in done:
+                            done.add(member)
+                            stack.append(member)
+                    elif member.startswith('&'):
+                        users.add(aliases[member[1:]])
+                    else:
+                        users.add(member)
+            expanded[group] = users
+        return users
 
     authz = {}
     for (module, path), items in sections.iteritems():
         section = authz.setdefault(module, {}).setdefault(path, {})
         for subject, perms in items:
-            for user in resolve(subject, set()):
-                section.setdefault(user, 'r' in perms)  # The first match wins
+            if subject.startswith('@'):
+                users = expand(subject[1:])
+            elif subject.startswith('&'):
+                users = (aliases[subject[1:]],)
+            else:
+                users = (subject,)
+            readable = 'r' in perms
+            for user in users:
+                section.setdefault(user, readable)  # The first match wins
 
     return authz
 
@@ -134,9 +181,19 @@ class AuthzSourcePolicy(Component):
         """)
 
     _mtime = 0
-    _authz = {}
-    _users = set()
-
+    _next_check = 0
+    _check_interval = 1.0  # seconds between checks of the authz file mtime
+    _info = ({}, set(), {}, {})  # (authz, users, allowed, results)
+    _max_results = 10000
+    _max_changesets = 1000
+    _anonymous_usernames = ('$anonymous', '*')
+
+    def __init__(self):
+        self._changed_paths = {}
+        self._parse_lock = threading.Lock()
+
+    _handled_actions = frozenset(['BROWSER_VIEW', 'CHANGESET_VIEW',
+                                  'FILE_VIEW', 'LOG_VIEW'])
     _handled_perms = frozenset([(None, 'BROWSER_VIEW'),
                                 (None, 'CHANGESET_VIEW'),
                                 (None, 'FILE_VIEW'),
@@ -149,18 +206,21 @@ class AuthzSourcePolicy(Component):
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
+        if action not in self._handled_actions:
+            return None
         realm = resource.realm if resource else None
         if (realm, action) in self._handled_perms:
-            authz, users = self._get_authz_info()
+            authz, users, allowed, results = self._get_authz_info()
             if authz is None:
                 return False
 
             if username == 'anonymous':
-                usernames = ('$anonymous', '*')
+                usernames = self._anonymous_usernames
             else:
                 usernames = (username, '$authenticated', '*')
             if resource is None:
-                return True if users & set(usernames) else None
+                return True if any(user in users for user in usernames) \
+                       else None
 
             rm = RepositoryManager(self.env)
             try:
@@ -173,18 +233,29 @@ class AuthzSourcePolicy(Component):
             if modules[0]:
                 modules.append('')
 
-            def check_path(path):
-                path = '/' + join(repos.scope, path)
-                if path != '/':
-                    path += '/'
+            key_prefix = (tuple(modules), usernames)
+            scope = repos.scope.strip('/')
+            scope_prefix = '/' + scope + '/' if scope else '/'
 
+            def check_path(path):
+                path = path.strip('/')
+                path = scope_prefix + path + '/' if path else scope_prefix
+                key = key_prefix + (path,)
+                try:
+                    return results[key]
+                except KeyError:
+                    pass
+                if len(results) >= self._max_results:
+                    results.clear()
+                results[key] = result = lookup_path(path)
+                return result
+
+            def lookup_path(path):
                 # Allow access to parent directories of allowed resources
-                if any(section.get(user) is True
-                       for module in modules
-                       for spath, section in authz.get(module, {}).iteritems()
-                       if spath.startswith(path)
-                       for user in usernames):
-                    return True
+                for module in modules:
+                    users = allowed.get(module, {}).get(path)
+                    if users and any(user in users for user in usernames):
+                        return True
 
                 # Walk from resource up parent directories
                 for spath in parent_iter(path):
@@ -200,39 +271,83 @@ class AuthzSourcePolicy(Component):
                 return check_path(resource.id)
 
             elif realm == 'changeset':
-                changes = list(repos.get_changeset(resource.id).get_changes())
-                if not changes or any(check_path(change[0])
-                                      for change in changes):
+                paths = self._get_changed_paths(repos, resource.parent.id,
+                                                resource.id)
+                if not paths or any(check_path(path) for path in paths):
                     return True
 
+    def _get_changed_paths(self, repos, reponame, rev):
+        """Return the paths changed in a changeset, remembering them for
+        subsequent checks."""
+        key = (reponame, rev)
+        paths = self._changed_paths.get(key)
+        if paths is None:
+            paths = [change[0] for change
+                     in repos.get_changeset(rev).get_changes()]
+            if len(self._changed_paths) >= self._max_changesets:
+                self._changed_paths.clear()
+            self._changed_paths[key] = paths
+        return paths
+
     def _get_authz_info(self):
+        """Return the `(authz, users, allowed, results)` tuple for the
+        current version of the authz file, parsing it if needed.
+        """
+        now = time.time()
+        if self._mtime and now < self._next_check:
+            return self._info
+        self._next_check = now + self._check_interval
         try:
-            mtime = os.path.getmtime(self.authz_file)
+            st = os.stat(self.authz_file)
         except OSError, e:
-            if self._authz is not None:
+            if self._info[0] is not None:
                 self.log.error('Error accessing authz file: %s',
                                exception_to_unicode(e))
-            self._mtime = mtime = 0
-            self._authz = None
-            self._users = set()
-        if mtime > self._mtime:
-            self._mtime = mtime
-            rm = RepositoryManager(self.env)
-            modules = set(repos.reponame
-                          for repos in rm.get_real_repositories())
-            if '' in modules and self.authz_module_name:
-                modules.add(self.authz_module_name)
-            modules.add('')
+            self._mtime = 0
+            self._info = (None, set(), {}, {})
+            return self._info
+        if st.st_mtime > self._mtime:
+            # Only one thread parses the file at a time. The other threads
+            # keep using the previous version meanwhile, if there's one.
+            if self._parse_lock.acquire(not self._mtime):
+                try:
+                    if st.st_mtime > self._mtime:
+                        self._parse_authz_file(st)
+                finally:
+                    self._parse_lock.release()
+        return self._info
+
+    def _parse_authz_file(self, st):
+        rm = RepositoryManager(self.env)
+        modules = set(repos.reponame
+                      for repos in rm.get_real_repositories())
+        if '' in modules and self.authz_module_name:
+            modules.add(self.authz_module_name)
+        modules.add('')
+        key = (st.st_mtime, st.st_size, frozenset(modules))
+        cached = _parsed_authz_files.get(self.authz_file)
+        if cached and cached[0] == key:
+            # already parsed by another environment, or before the
+            # environment was reloaded
+            info = cached[1]
+        else:
             self.log.info('Parsing authz file: %s' % self.authz_file)
             try:
-                self._authz = parse(read_file(self.authz_file), modules)
-                self._users = set(user for paths in self._authz.itervalues()
-                                  for path in paths.itervalues()
-                                  for user, result in path.iteritems()
-                                  if result)
+                authz = parse(read_file(self.authz_file), modules)
+                users = set()
+                for paths in authz.itervalues():
+                    for section in paths.itervalues():
+                        users.update(user for user, result
+                                          in section.iteritems() if result)
+                allowed = dict((module, allowed_users_by_dir(paths))
+                               for module, paths in authz.iteritems())
+                info = (authz, users, allowed)
+                _parsed_authz_files[self.authz_file] = (key, info)
             except Exception, e:
-                self._authz = None
-                self._users = set()
+                info = (None, set(), {})
                 self.log.error('Error parsing authz file: %s',
                                exception_to_unicode(e))
-        return self._authz, self._users
+        # Replace the whole tuple at once, so that no thread sees results
+        # of a previous version together with the new rules
+        self._info = info + ({},)
+        self._mtime = st.st_mtime
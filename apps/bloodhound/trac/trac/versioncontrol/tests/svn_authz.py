@@ -84,6 +84,39 @@ foo = r
             },
         }, authz)
 
+    def test_parse_nested_groups(self):
+        authz = parse("""\
+[groups]
+outer = @inner, &baz
+inner = @outer, foo
+other = @inner, bar
+
+[aliases]
+baz = Baz
+
+[/]
+bar = rw
+@other = r
+
+[/trunk]
+@outer =
+@other = r
+""", set(['']))
+        self.assertEqual({
+            '': {
+                '/': {
+                    'foo': True,
+                    'bar': True,
+                    'Baz': True,
+                },
+                '/trunk': {
+                    'foo': False,
+                    'Baz': False,
+                    'bar': True,
+                },
+            },
+        }, authz)
+
     def test_parse_errors(self):
         self.assertRaises(ParseError, parse, """\
 user = r
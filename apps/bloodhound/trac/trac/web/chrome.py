@@ -996,8 +996,7 @@ class Chrome(Component):
 
         doctype = {'text/html': Chrome.default_html_doctype}.get(content_type)
         if doctype:
-            if req.form_token:
-                stream |= self._add_form_token(req.form_token)
+            stream |= self._add_form_token(req)
             if not int(req.session.get('accesskeys', 0)):
                 stream |= self._strip_accesskeys
 
@@ -1137,15 +1136,20 @@ class Chrome(Component):
 
     # Template filters
 
-    def _add_form_token(self, token):
-        elem = tag.div(
-            tag.input(type='hidden', name='__FORM_TOKEN', value=token)
-        )
+    def _add_form_token(self, req):
         def _generate(stream, ctxt=None):
+            elem = None
             for kind, data, pos in stream:
                 if kind is START and data[0].localname == 'form' \
                                  and data[1].get('method', '').lower() == 'post':
                     yield kind, data, pos
+                    if elem is None:
+                        # the token (and its cookie) is only created for
+                        # pages that contain a POST form
+                        elem = tag.div(
+                            tag.input(type='hidden', name='__FORM_TOKEN',
+                                      value=req.form_token)
+                        )
                     for event in elem.generate():
                         yield event
                 else:
@@ -16,11 +16,10 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 #         Matthew Good <trac@matt-good.net>
 
-import cgi
-import dircache
 import fnmatch
 from functools import partial
 import gc
+from itertools import count
 import locale
 import os
 import pkg_resources
@@ -57,6 +56,11 @@ from trac.web.session import Session
 #: Trac instance if you distribute a patched version of Trac.
 default_tracker = 'http://trac.edgewall.org'
 
+#: A full garbage collection is done after every `_gc_interval` requests
+#: (or never, if set to 0 through the `TRAC_GC_INTERVAL` variable).
+_gc_interval = int(os.environ.get('TRAC_GC_INTERVAL', 100))
+_request_count = count(1)
+
 
 class FakeSession(dict):
     sid = None
@@ -128,6 +132,9 @@ class RequestDispatcher(Component):
         like Apache with `mod_xsendfile` or lighttpd. (''since 1.0'')
         """)
 
+    def __init__(self):
+        self._extra_arg_counts = {}
+
     # Public API
 
     def authenticate(self, req):
@@ -161,11 +168,14 @@ class RequestDispatcher(Component):
             'use_xsendfile': self._get_use_xsendfile,
         })
 
+        filters = []
         try:
             try:
                 # Select the component that should handle the request
                 chosen_handler = None
                 try:
+                    # retrieve the filters once for pre- and post-processing
+                    filters = self.filters
                     for handler in self.handlers:
                         if handler.match_request(req):
                             chosen_handler = handler
@@ -176,7 +186,8 @@ class RequestDispatcher(Component):
                     # pre-process any incoming request, whether a handler
                     # was found or not
                     chosen_handler = self._pre_process_request(req,
-                                                            chosen_handler)
+                                                            chosen_handler,
+                                                            filters)
                 except TracError, e:
                     raise HTTPInternalError(e)
                 if not chosen_handler:
@@ -198,7 +209,8 @@ class RequestDispatcher(Component):
                 if req.method == 'POST':
                     ctype = req.get_header('Content-Type')
                     if ctype:
-                        ctype, options = cgi.parse_header(ctype)
+                        # only the media type is needed, not its parameters
+                        ctype = ctype.split(';', 1)[0].strip()
                     if ctype in ('application/x-www-form-urlencoded',
                                  'multipart/form-data') and \
                             req.args.get('__FORM_TOKEN') != req.form_token:
@@ -221,7 +233,8 @@ class RequestDispatcher(Component):
                               "please contact your Trac administrator."))
                     # Genshi
                     template, data, content_type = \
-                              self._post_process_request(req, *resp)
+                              self._post_process_request(req, filters,
+                                                         *resp)
                     if 'hdfdump' in req.args:
                         req.perm.require('TRAC_ADMIN')
                         # debugging helper - no need to render first
@@ -233,14 +246,14 @@ class RequestDispatcher(Component):
                                                     content_type)
                     req.send(output, content_type or 'text/html')
                 else:
-                    self._post_process_request(req)
+                    self._post_process_request(req, filters)
             except RequestDone:
                 raise
             except:
                 # post-process the request in case of errors
                 err = sys.exc_info()
                 try:
-                    self._post_process_request(req)
+                    self._post_process_request(req, filters)
                 except RequestDone:
                     raise
                 except Exception, e:
@@ -261,7 +274,7 @@ class RequestDispatcher(Component):
         if isinstance(req.session, FakeSession):
             return FakePerm()
         else:
-            return PermissionCache(self.env, self.authenticate(req))
+            return PermissionCache(self.env, req.authname)
 
     def _get_session(self, req):
         try:
@@ -305,35 +318,43 @@ class RequestDispatcher(Component):
 
         If the the user does not have a `trac_form_token` cookie a new
         one is generated.
+
+        The token is computed once per request, as `req.form_token`.
         """
-        if req.incookie.has_key('trac_form_token'):
-            return req.incookie['trac_form_token'].value
-        else:
-            req.outcookie['trac_form_token'] = hex_entropy(24)
-            req.outcookie['trac_form_token']['path'] = req.base_path or '/'
-            if self.env.secure_cookies:
-                req.outcookie['trac_form_token']['secure'] = True
-            if sys.version_info >= (2, 6):
-                req.outcookie['trac_form_token']['httponly'] = True
-            return req.outcookie['trac_form_token'].value
+        cookie = req.incookie.get('trac_form_token')
+        if cookie is not None:
+            return cookie.value
+        token = hex_entropy(24)
+        req.outcookie['trac_form_token'] = token
+        cookie = req.outcookie['trac_form_token']
+        cookie['path'] = req.base_path or '/'
+        if self.env.secure_cookies:
+            cookie['secure'] = True
+        if sys.version_info >= (2, 6):
+            cookie['httponly'] = True
+        return token
 
     def _get_use_xsendfile(self, req):
         return self.use_xsendfile
 
-    def _pre_process_request(self, req, chosen_handler):
-        for filter_ in self.filters:
+    def _pre_process_request(self, req, chosen_handler, filters):
+        for filter_ in filters:
             chosen_handler = filter_.pre_process_request(req, chosen_handler)
         return chosen_handler
 
-    def _post_process_request(self, req, *args):
+    def _post_process_request(self, req, filters, *args):
         nbargs = len(args)
         resp = args
-        for f in reversed(self.filters):
+        extra_arg_counts = self._extra_arg_counts
+        for f in reversed(filters):
             # As the arity of `post_process_request` has changed since
             # Trac 0.10, only filters with same arity gets passed real values.
             # Errors will call all filters with None arguments,
             # and results will not be not saved.
-            extra_arg_count = arity(f.post_process_request) - 1
+            extra_arg_count = extra_arg_counts.get(f.__class__)
+            if extra_arg_count is None:
+                extra_arg_count = arity(f.post_process_request) - 1
+                extra_arg_counts[f.__class__] = extra_arg_count
             if extra_arg_count == nbargs:
                 resp = f.post_process_request(req, *resp)
             elif nbargs == 0:
@@ -342,6 +363,9 @@ class RequestDispatcher(Component):
 
 _slashes_re = re.compile(r'/+')
 
+# The locale last set by `dispatch_request`
+_current_locale = None
+
 
 def dispatch_request(environ, start_response):
     """Main entry point for the Trac web interface.
@@ -359,8 +383,10 @@ def dispatch_request(environ, start_response):
             environ['SCRIPT_NAME'] = script_url
         else:
             # mod_wsgi squashes slashes in PATH_INFO (!)
-            script_url = _slashes_re.sub('/', script_url)
-            path_info = _slashes_re.sub('/', path_info)
+            if '//' in script_url:
+                script_url = _slashes_re.sub('/', script_url)
+            if '//' in path_info:
+                path_info = _slashes_re.sub('/', path_info)
             if script_url.endswith(path_info):
                 environ['SCRIPT_NAME'] = script_url[:-len(path_info)]
 
@@ -379,7 +405,12 @@ def dispatch_request(environ, start_response):
     environ.setdefault('trac.bootstrap_handler',
                        os.getenv('TRAC_BOOTSTRAP_HANDLER'))
 
-    locale.setlocale(locale.LC_ALL, environ['trac.locale'])
+    # setlocale() changes the process-wide locale, so only call it when
+    # a different locale is requested
+    global _current_locale
+    if environ['trac.locale'] != _current_locale:
+        locale.setlocale(locale.LC_ALL, environ['trac.locale'])
+        _current_locale = environ['trac.locale']
 
     # Load handler for environment lookup and instantiation of request objects
     from trac.hooks import load_bootstrap_handler
@@ -447,19 +478,22 @@ def dispatch_request(environ, start_response):
         translation.deactivate()
         if env and not run_once:
             env.shutdown(threading._get_ident())
-            # Now it's a good time to do some clean-ups
+            # Now it's a good time to do some clean-ups (a full collection
+            # takes a while with many objects, so only do it periodically)
             #
             # Note: enable the '##' lines as soon as there's a suspicion
             #       of memory leak due to uncollectable objects (typically
             #       objects with a __del__ method caught in a cycle)
             #
-            ##gc.set_debug(gc.DEBUG_UNCOLLECTABLE)
-            unreachable = gc.collect()
-            ##env.log.debug("%d unreachable objects found.", unreachable)
-            ##uncollectable = len(gc.garbage)
-            ##if uncollectable:
-            ##    del gc.garbage[:]
-            ##    env.log.warn("%d uncollectable objects found.", uncollectable)
+            if _gc_interval and _request_count.next() % _gc_interval == 0:
+                ##gc.set_debug(gc.DEBUG_UNCOLLECTABLE)
+                unreachable = gc.collect()
+                ##env.log.debug("%d unreachable objects found.", unreachable)
+                ##uncollectable = len(gc.garbage)
+                ##if uncollectable:
+                ##    del gc.garbage[:]
+                ##    env.log.warn("%d uncollectable objects found.",
+                ##                 uncollectable)
 
 
 def _dispatch_request(req, env, env_error):
@@ -559,12 +593,18 @@ def send_internal_error(env, req, exc_info):
                 elif info.get('home_page', '').startswith(th):
                     tracker = th
 
+    # The request parameters and system information are the same in both
+    # descriptions, so they're only formatted once
+    req_args = pformat(req.args)
+    if env and has_admin:
+        admin_sys_info = "".join("|| '''`%s`''' || `%s` ||\n"
+                                 % (k, v.replace('\n', '` [[br]] `'))
+                                 for k, v in env.get_systeminfo())
+        admin_sys_info += "|| '''`jQuery`''' || `#JQUERY#` ||\n"
+
     def get_description(_):
         if env and has_admin:
-            sys_info = "".join("|| '''`%s`''' || `%s` ||\n"
-                               % (k, v.replace('\n', '` [[br]] `'))
-                               for k, v in env.get_systeminfo())
-            sys_info += "|| '''`jQuery`''' || `#JQUERY#` ||\n"
+            sys_info = admin_sys_info
             enabled_plugins = "".join("|| '''`%s`''' || `%s` ||\n"
                                       % (p['name'], p['version'] or _('N/A'))
                                       for p in plugins)
@@ -593,7 +633,7 @@ User agent: `#USER_AGENT#`
 {{{
 %(traceback)s}}}""",
             method=req.method, path_info=req.path_info,
-            req_args=pformat(req.args), sys_info=sys_info,
+            req_args=req_args, sys_info=sys_info,
             enabled_plugins=enabled_plugins, traceback=to_unicode(traceback))
 
     # Generate the description once in English, once in the current locale
@@ -617,6 +657,10 @@ User agent: `#USER_AGENT#`
         pass
 
 
+# Template loaders of the project index, by load paths. They keep the
+# compiled templates, and reload them when they are modified.
+_index_loaders = {}
+
 def send_project_index(environ, start_response, parent_dir=None,
                        env_paths=None):
     req = Request(environ, start_response)
@@ -652,12 +696,16 @@ def send_project_index(environ, start_response, parent_dir=None,
             except Exception, e:
                 proj = {'name': env_name, 'description': to_unicode(e)}
             projects.append(proj)
-        projects.sort(lambda x, y: cmp(x['name'].lower(), y['name'].lower()))
+        projects.sort(key=lambda proj: proj['name'].lower())
 
         data['projects'] = projects
 
-        loader = TemplateLoader(loadpaths, variable_lookup='lenient',
-                                default_encoding='utf-8')
+        loader = _index_loaders.get(tuple(loadpaths))
+        if loader is None:
+            loader = TemplateLoader(loadpaths, variable_lookup='lenient',
+                                    default_encoding='utf-8',
+                                    auto_reload=True)
+            _index_loaders[tuple(loadpaths)] = loader
         tmpl = loader.load(template)
         stream = tmpl.generate(**data)
         if template.endswith('.xml'):
@@ -684,6 +732,33 @@ def get_tracignore_patterns(env_parent_dir):
     return [line for line in lines if line and not line.startswith('#')]
 
 
+_tracignore_cache = {}
+
+def _get_tracignore_re(env_parent_dir):
+    """Return a regexp matching the names ignored by the .tracignore
+    patterns of `env_parent_dir`, or `None` if nothing is ignored.
+
+    The regexp is cached until the .tracignore file changes.
+    """
+    path = os.path.join(env_parent_dir, '.tracignore')
+    try:
+        st = os.stat(path)
+        key = (st.st_mtime, st.st_size)
+    except OSError:
+        key = None
+    cached = _tracignore_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    ignore_re = None
+    ignore_patterns = get_tracignore_patterns(env_parent_dir)
+    if ignore_patterns:
+        ignore_re = re.compile('|'.join(
+            '(?:%s)' % fnmatch.translate(os.path.normcase(pattern))
+            for pattern in ignore_patterns))
+    _tracignore_cache[path] = (key, ignore_re)
+    return ignore_re
+
+
 def get_environments(environ, warn=False):
     """Retrieve canonical environment name to path mapping.
 
@@ -694,14 +769,14 @@ def get_environments(environ, warn=False):
     env_parent_dir = environ.get('trac.env_parent_dir')
     if env_parent_dir:
         env_parent_dir = os.path.normpath(env_parent_dir)
-        paths = dircache.listdir(env_parent_dir)[:]
-        dircache.annotate(env_parent_dir, paths)
-
-        # Filter paths that match the .tracignore patterns
-        ignore_patterns = get_tracignore_patterns(env_parent_dir)
-        paths = [path[:-1] for path in paths if path[-1] == '/'
-                 and not any(fnmatch.fnmatch(path[:-1], pattern)
-                             for pattern in ignore_patterns)]
+        paths = sorted(os.listdir(env_parent_dir))
+
+        # Filter paths that match the .tracignore patterns (files are
+        # skipped by the `isdir()` check below)
+        ignore_re = _get_tracignore_re(env_parent_dir)
+        if ignore_re:
+            paths = [path for path in paths
+                     if not ignore_re.match(os.path.normcase(path))]
         env_paths.extend(os.path.join(env_parent_dir, project) \
                          for project in paths)
     envs = {}
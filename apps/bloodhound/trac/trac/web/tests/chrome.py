@@ -11,6 +11,8 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+from genshi.input import HTML
+
 from trac.core import Component, implements
 from trac.test import EnvironmentStub
 from trac.tests.contentgen import random_sentence
@@ -135,6 +137,34 @@ class ChromeTestCase(unittest.TestCase):
         add_notice(req, message)
         self.assertEqual(1, len(req.chrome['notices']))
 
+    def test_add_form_token(self):
+        class TokenRequest(object):
+            tokens = 0
+            @property
+            def form_token(self):
+                self.tokens += 1
+                return 'f0rmt0ken'
+        chrome = Chrome(self.env)
+
+        req = TokenRequest()
+        html = HTML(u'<div><form method="post"></form>'
+                    u'<form method="POST"></form></div>')
+        output = (html | chrome._add_form_token(req)).render('xhtml')
+        self.assertEqual('<div><form method="post"><div><input '
+                         'type="hidden" name="__FORM_TOKEN" '
+                         'value="f0rmt0ken" /></div></form>'
+                         '<form method="POST"><div><input '
+                         'type="hidden" name="__FORM_TOKEN" '
+                         'value="f0rmt0ken" /></div></form></div>', output)
+        self.assertEqual(1, req.tokens)
+
+        # No token is created for pages without POST forms
+        req = TokenRequest()
+        html = HTML(u'<div><form method="get"></form></div>')
+        output = (html | chrome._add_form_token(req)).render('xhtml')
+        self.assertEqual('<div><form method="get"></form></div>', output)
+        self.assertEqual(0, req.tokens)
+
     def test_htdocs_location(self):
         req = Request(abs_href=Href('http://example.org/trac.cgi'),
                       href=Href('/trac.cgi'), base_path='/trac.cgi',
@@ -73,6 +73,18 @@ class EnvironmentsTestCase(unittest.TestCase):
         self.assertEquals(self.env_paths(['mydir2', '.hidden_dir']),
                           get_environments(self.environ))
 
+    def test_modified_tracignore(self):
+        def environments():
+            return get_environments({'trac.env_parent_dir': self.parent_dir})
+        create_file(self.tracignore, 'mydir1')
+        self.assertEquals(self.env_paths(['mydir2', '.hidden_dir']),
+                          environments())
+        create_file(self.tracignore, 'mydir1\nmydir2')
+        self.assertEquals(self.env_paths(['.hidden_dir']), environments())
+        os.unlink(self.tracignore)
+        self.assertEquals(self.env_paths(['mydir1', 'mydir2']),
+                          environments())
+
 
 def suite():
     suite = unittest.TestSuite()
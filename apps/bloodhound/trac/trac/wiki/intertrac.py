@@ -14,9 +14,7 @@
 #
 # Author: Christian Boos <cboos@edgewall.org>
 
-import re
-
-from genshi.builder import Element, Fragment, tag
+from genshi.builder import Fragment, tag
 
 from trac.config import ConfigSection
 from trac.core import *
@@ -70,13 +68,16 @@ class InterTracDispatcher(Component):
         }}}
         """)
 
+    def __init__(self):
+        self._intertracs = (None, {}, ())
+
     # IRequestHandler methods
 
     def match_request(self, req):
-        match = re.match(r'^/intertrac/(.*)', req.path_info)
-        if match:
-            if match.group(1):
-                req.args['link'] = match.group(1)
+        if req.path_info.startswith('/intertrac/'):
+            link = req.path_info[11:]
+            if link:
+                req.args['link'] = link
             return True
 
     def process_request(self, req):
@@ -84,11 +85,12 @@ class InterTracDispatcher(Component):
         parts = link.split(':', 1)
         if len(parts) > 1:
             resolver, target = parts
-            if target[:1] + target[-1:] not in ('""', "''"):
+            if not (target and target[0] == target[-1] and
+                    target[0] in '"\''):
                 link = '%s:"%s"' % (resolver, target)
         from trac.web.chrome import web_context
         link_frag = extract_link(self.env, web_context(req), link)
-        if isinstance(link_frag, (Element, Fragment)):
+        if isinstance(link_frag, Fragment):
             elt = find_element(link_frag, 'href')
             if elt is None: # most probably no permissions to view
                 raise PermissionError(_("Can't view %(link)s:", link=link))
@@ -106,16 +108,9 @@ class InterTracDispatcher(Component):
         return 'messages', N_("Provide a list of known InterTrac prefixes.")
 
     def expand_macro(self, formatter, name, content):
-        intertracs = {}
-        for key, value in self.intertrac_section.options():
-            idx = key.rfind('.')
-            if idx > 0: # 0 itself doesn't help much: .xxx = ...
-                prefix, attribute = key[:idx], key[idx+1:]
-                intertrac = intertracs.setdefault(prefix, {})
-                intertrac[attribute] = value
-            else:
-                intertracs[key] = value # alias
+        intertracs, prefixes = self._get_intertracs()
         if 'trac' not in intertracs:
+            intertracs = dict(intertracs)
             intertracs['trac'] = {'title': _('The Trac Project'),
                                   'url': 'http://trac.edgewall.org'}
 
@@ -134,4 +129,28 @@ class InterTracDispatcher(Component):
 
         return tag.table(class_="wiki intertrac")(
             tag.tr(tag.th(tag.em('Prefix')), tag.th(tag.em('Trac Site'))),
-            [generate_prefix(p) for p in sorted(intertracs.keys())])
+            (row for p in prefixes for row in generate_prefix(p)))
+
+    def _get_intertracs(self):
+        """Return the InterTrac prefixes and aliases configured in the
+        `[intertrac]` section, parsing the options only when they changed.
+
+        :return: a `(intertracs, prefixes)` tuple, where `prefixes` is the
+                 sorted tuple of the configured prefixes and of `trac`
+        """
+        options = tuple(self.intertrac_section.options())
+        cached_options, intertracs, prefixes = self._intertracs
+        if options != cached_options:
+            intertracs = {}
+            for key, value in options:
+                prefix, sep, attribute = key.rpartition('.')
+                if prefix: # '' itself doesn't help much: .xxx = ...
+                    intertrac = intertracs.setdefault(prefix, {})
+                    intertrac[attribute] = value
+                else:
+                    intertracs[key] = value # alias
+            prefixes = set(intertracs)
+            prefixes.add('trac')
+            prefixes = tuple(sorted(prefixes))
+            self._intertracs = (options, intertracs, prefixes)
+        return intertracs, prefixes
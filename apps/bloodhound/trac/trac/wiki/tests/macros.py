@@ -409,6 +409,24 @@ def tracini_teardown(tc):
     Option.registry = tc._orig_registry
 
 
+INTERTRAC_MACRO_TEST_CASES = u"""\
+============================== InterTrac, prefixes and aliases
+[[InterTrac]]
+------------------------------
+<p>
+</p><table class="wiki intertrac">\
+<tr><th><em>Prefix</em></th><th><em>Trac Site</em></th></tr>\
+<tr><td><b>t</b></td><td>Alias for <b>trac</b></td></tr>\
+<tr><td><a href="http://trac-hacks.org/timeline"><b>th</b></a></td>\
+<td><a href="http://trac-hacks.org">Trac Hacks</a></td></tr>\
+<tr><td><a href="http://trac.edgewall.org/timeline"><b>trac</b></a></td>\
+<td><a href="http://trac.edgewall.org">Trac's Trac</a></td></tr>\
+</table><p>
+</p>
+------------------------------
+"""
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(formatter.suite(IMAGE_MACRO_TEST_CASES, file=__file__))
@@ -431,6 +449,7 @@ def suite():
     suite.addTest(formatter.suite(TRACINI_MACRO_TEST_CASES, file=__file__,
                                   setup=tracini_setup,
                                   teardown=tracini_teardown))
+    suite.addTest(formatter.suite(INTERTRAC_MACRO_TEST_CASES, file=__file__))
     return suite
 
 
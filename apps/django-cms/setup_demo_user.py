@@ -4,21 +4,21 @@ from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.contrib.auth import authenticate
 
+BANNER = '*' * 80
+
 # Create our own demo user automatically.
-try:
-    auth_models.User.objects.get(username='demo')
-except auth_models.User.DoesNotExist:
-    print '*' * 80
+if not auth_models.User.objects.filter(username='demo').exists():
+    print BANNER
     print 'Creating demo user -- login: demo, password: demo'
-    print '*' * 80
+    print BANNER
     assert auth_models.User.objects.create_superuser('demo', 's@s.com', 'demo')
 else:
     print 'Demo user already exists.'
 
 # Test authentication
-print '*' * 80
+print BANNER
 print 'Testing demo user authentication.'
-print '*' * 80
+print BANNER
 user = authenticate(username='demo', password='demo')
 if user is not None:
     if user.is_active: